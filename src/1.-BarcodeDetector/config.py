@@ -9,6 +9,9 @@ CAMERA_CONFIG = {
     'width': 1280,
     'height': 720,
     'fps': 30,
+    'fourcc': 'MJPG',
+    'buffer_size': 1,
+    'grab_count': 1,  # Subir a 2 si el driver ignora buffer_size
     'autofocus': True,
     'focus': 0
 }
@@ -16,8 +19,23 @@ CAMERA_CONFIG = {
 # Configuración de Detección
 DETECTION_CONFIG = {
     'cooldown_seconds': 2.0,
+    'pipeline_queue_size': 2,
+    'scan_cache_size': 32,
     'supported_symbols': ['EAN13', 'UPCA', 'CODE128'],
+    'decoder_backend': 'auto',  # 'auto' (zxing-cpp si está instalado), 'zxing' o 'pyzbar'
     'scales': [1.0, 1.2, 0.8, 1.4],
+    'downsample_threshold': 512,
+    'decode_workers': None,  # None: min(nº de escalas, nº de núcleos)
+    'hit_decay_interval': 100,
+    'hit_decay_factor': 0.9,
+    'use_roi': True,
+    'roi_padding': 0.1,
+    'roi_gradient_threshold': 64,
+    'roi_pyramid_levels': 2,
+    'large_barcode_area': 0.3,  # Fracción del frame a partir de la cual se decodifica a mitad de resolución
+    'use_opencv_detector': True,
+    'opencv_detector_scales': [0.01, 0.03, 0.06, 0.08],
+    'opencv_downsampling_threshold': 512,
     'processing_modes': [
         "Original",
         "Escala de grises",
@@ -31,24 +49,38 @@ DETECTION_CONFIG = {
 IMAGE_PROCESSING = {
     'clahe_clip_limit': 3.0,
     'clahe_tile_grid_size': (8, 8),
+    'input_bit_depth': 12,  # Profundidad real de los frames de 16 bits
+    'use_opencl': True,  # Filtros en GPU vía cv2.UMat si hay OpenCL
+    'contrast_std_threshold': 40.0,
     'adaptive_threshold_max_value': 255,
     'adaptive_threshold_block_size': 11,
     'adaptive_threshold_c': 2,
     'morphology_kernel_size': (2, 2),
+    'gaussian_kernel_size': (3, 3),
+    'use_bilateral': False,  # Filtro bilateral (muy costoso) como última variante
     'bilateral_filter_d': 9,
     'bilateral_filter_sigma_color': 75,
     'bilateral_filter_sigma_space': 75
 }
 
+# Configuración de Almacenamiento
+STORAGE_CONFIG = {
+    'max_history': 10000
+}
+
 # Configuración de Interfaz
 UI_CONFIG = {
     'window_name': 'Barcode Scanner',
+    'display_fps': 30,
+    'text_cache_size': 64,
+    'barcode_cache_size': 64,
     'font': 'cv2.FONT_HERSHEY_SIMPLEX',
     'font_scale': 0.6,
     'font_color': (255, 255, 255),
     'font_thickness': 2,
     'rectangle_color': (0, 255, 0),
     'rectangle_thickness': 2,
+    'label_thickness': 1,
     'type_color': (255, 0, 0)
 }
 
@@ -69,6 +101,8 @@ MESSAGES = {
             "   - Presiona 'q' para salir",
             "   - Presiona 'c' para limpiar historial",
             "   - Presiona 's' para cambiar modo de procesamiento",
+            "   - Presiona 'e' para exportar códigos a JSON",
+            "   - Presiona 'r' para ver estadísticas",
             "   - Mantén el código de barras estable frente a la cámara"
         ],
         'separator': "=" * 50
@@ -84,6 +118,8 @@ MESSAGES = {
         'user_interrupt': "⚠️ Detenido por el usuario",
         'history_cleared': "🧹 Historial limpiado",
         'mode_changed': "🔄 Modo cambiado a:",
+        'export_success': "✅ Códigos exportados a",
+        'export_error': "❌ Error exportando códigos",
         'goodbye': "👋 ¡Hasta luego!"
     }
 }
@@ -4,6 +4,8 @@ Clase principal del detector de códigos de barras
 """
 
 import cv2
+import queue
+import threading
 from datetime import datetime
 from typing import Optional
 
@@ -42,6 +44,11 @@ class BarcodeDetector:
         self.processing_mode = 0
         self.cap = None
 
+        # Pipeline de hilos (captura -> procesamiento -> visualización)
+        self.queue_size = self.detection_config['pipeline_queue_size']
+        self._stop_event = threading.Event()
+        self._threads = []
+
     def initialize(self) -> bool:
         """
         Inicializa todos los componentes del detector
@@ -92,52 +99,149 @@ class BarcodeDetector:
             len(self.storage.detected_codes)
         )
 
-    def process_frame(self, frame):
+    def detect_barcodes(self, frame):
         """
-        Procesa un frame completo para detectar códigos de barras
+        Busca códigos de barras en el frame probando las versiones preprocesadas
 
         Args:
             frame: Frame de la cámara
 
         Returns:
-            Frame procesado con información visual
+            tuple: (lista_barcodes, factor_escala_usado)
         """
-        # Preprocesar frame
-        original_frame, processed_frames = self.image_processor.preprocess_frame(
-            frame)
+        return self.image_processor.detect_barcodes(frame)
 
-        # Intentar detectar códigos
-        barcodes = []
-        scale_factor = 1.0
+    def render_detections(self, frame, barcodes, scale_factor: float = 1.0):
+        """
+        Dibuja y registra los códigos encontrados en un frame
+
+        Args:
+            frame: Frame de la cámara
+            barcodes: Códigos devueltos por detect_barcodes
+            scale_factor: Factor de escala con el que se detectaron
 
-        # Probar con diferentes frames procesados
-        for processed_frame in processed_frames:
-            detected_barcodes, detected_scale = self.image_processor.detect_with_multiple_scales(
-                processed_frame)
-            if detected_barcodes:
-                barcodes = detected_barcodes
-                scale_factor = detected_scale
-                break
+        Returns:
+            Frame procesado con información visual
+        """
+        # Dibujar todos los códigos encontrados de una vez
+        drawn = self.display_manager.draw_barcodes_batch(
+            frame, barcodes, scale_factor)
 
         # Procesar códigos encontrados
-        for barcode in barcodes:
-            barcode_value, barcode_type = self.display_manager.draw_barcode_info(
-                original_frame, barcode, scale_factor
-            )
-
+        for barcode_value, barcode_type in drawn:
             # Solo procesar si no es duplicado reciente
             if self.storage.should_process_detection(barcode_value):
                 self.process_detected_code(barcode_value, barcode_type)
 
         # Añadir información de interfaz
         self.display_manager.draw_interface_info(
-            original_frame,
+            frame,
             len(self.storage.detected_codes),
             self.processing_mode,
             self.detection_config['processing_modes']
         )
 
-        return original_frame
+        return frame
+
+    def process_frame(self, frame):
+        """
+        Procesa un frame completo para detectar códigos de barras
+
+        Args:
+            frame: Frame de la cámara
+
+        Returns:
+            Frame procesado con información visual
+        """
+        barcodes, scale_factor = self.detect_barcodes(frame)
+        return self.render_detections(frame, barcodes, scale_factor)
+
+    def _recycle_frame(self, frame):
+        """
+        Devuelve un buffer de frame al pool para reutilizarlo en la captura
+
+        Args:
+            frame: Frame que ya no se va a usar
+        """
+        self.camera_manager.recycle_frame(frame)
+
+    def _put_latest(self, target_queue: queue.Queue, item):
+        """
+        Encola un elemento descartando el más antiguo si la cola está llena,
+        de forma que la latencia quede acotada por el tamaño de la cola
+
+        Args:
+            target_queue: Cola de destino
+            item: Elemento a encolar (frame o tupla cuyo primer campo es el frame)
+        """
+        while True:
+            try:
+                target_queue.put_nowait(item)
+                return
+            except queue.Full:
+                try:
+                    dropped = target_queue.get_nowait()
+                except queue.Empty:
+                    continue
+
+                if isinstance(dropped, tuple):
+                    dropped = dropped[0]
+                if dropped is not None:
+                    self._recycle_frame(dropped)
+
+    def _processing_loop(self, results_queue: queue.Queue):
+        """
+        Hilo de procesamiento: preprocesa y decodifica el frame más reciente
+        del hilo de captura de la cámara
+
+        Args:
+            results_queue: Cola hacia el hilo principal (visualización)
+        """
+        while not self._stop_event.is_set():
+            frame = self.camera_manager.read_async(timeout=0.1)
+
+            if frame is None:
+                if not self.camera_manager.is_capturing():
+                    break
+                continue
+
+            barcodes, scale_factor = self.detect_barcodes(frame)
+            self._put_latest(results_queue, (frame, barcodes, scale_factor))
+
+        self._put_latest(results_queue, None)
+
+    def _start_pipeline(self) -> queue.Queue:
+        """
+        Arranca los hilos de captura y procesamiento
+
+        Returns:
+            Cola de la que el hilo principal obtiene (frame, barcodes, escala)
+        """
+        results_queue = queue.Queue(maxsize=self.queue_size)
+
+        # Buffers en circulación: el último capturado, el que se procesa,
+        # los de la cola de resultados y el que se está mostrando
+        self.camera_manager.start_async(pool_size=self.queue_size + 3)
+
+        self._stop_event.clear()
+        self._threads = [
+            threading.Thread(target=self._processing_loop,
+                             args=(results_queue,), daemon=True)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+        return results_queue
+
+    def _stop_pipeline(self):
+        """
+        Detiene los hilos del pipeline y espera a que terminen
+        """
+        self._stop_event.set()
+        self.camera_manager.stop_async()
+        for thread in self._threads:
+            thread.join(timeout=1.0)
+        self._threads = []
 
     def handle_keyboard_input(self, key: int) -> bool:
         """
@@ -154,6 +258,7 @@ class BarcodeDetector:
 
         elif key == ord('c'):
             self.storage.clear_history()
+            self.image_processor.clear_scan_cache()
             self.display_manager.print_system_message('history_cleared')
 
         elif key == ord('s'):
@@ -168,18 +273,15 @@ class BarcodeDetector:
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
             filename = f"codigos_detectados_{timestamp}.json"
             if self.storage.export_to_json(filename):
-                print(f"✅ Códigos exportados a {filename}")
+                self.display_manager.print_system_message(
+                    'export_success', filename)
             else:
-                print("❌ Error exportando códigos")
+                self.display_manager.print_system_message('export_error')
 
         elif key == ord('r'):
             # Mostrar estadísticas
-            stats = self.storage.get_statistics()
-            print("\n📊 ESTADÍSTICAS:")
-            print(f"   Total: {stats['total']}")
-            print(f"   Válidos: {stats['valid']}")
-            print(f"   Farmacéuticos: {stats['pharmaceutical']}")
-            print(f"   Tasa de detección: {stats['detection_rate']:.2%}")
+            self.display_manager.print_statistics(
+                self.storage.get_statistics())
 
         return True
 
@@ -193,24 +295,35 @@ class BarcodeDetector:
 
         # Mostrar mensajes de inicio
         self.display_manager.print_startup_messages()
-        print("   - Presiona 'e' para exportar códigos a JSON")
-        print("   - Presiona 'r' para ver estadísticas")
 
         self.is_running = True
 
         try:
+            # Captura y decodificación corren en hilos propios; imshow y
+            # waitKey deben quedarse en el hilo principal
+            results_queue = self._start_pipeline()
+
             while self.is_running and self.cap.isOpened():
-                ret, frame = self.cap.read()
-                if not ret:
+                try:
+                    result = results_queue.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+
+                if result is None:
                     self.display_manager.print_system_message('camera_error')
                     break
 
-                # Procesar frame
-                processed_frame = self.process_frame(frame)
+                # Dibujar resultados del frame procesado
+                frame, barcodes, scale_factor = result
+                processed_frame = self.render_detections(
+                    frame, barcodes, scale_factor)
 
                 # Mostrar frame
                 self.display_manager.display_frame(processed_frame)
 
+                # El frame ya se copió a la ventana: su buffer puede reutilizarse
+                self._recycle_frame(frame)
+
                 # Manejar entrada de teclado
                 key = cv2.waitKey(1) & 0xFF
                 if key != 255:  # Si se presionó alguna tecla
@@ -221,6 +334,7 @@ class BarcodeDetector:
             self.display_manager.print_system_message('user_interrupt')
 
         finally:
+            self._stop_pipeline()
             self.cleanup()
 
     def cleanup(self):
@@ -228,7 +342,11 @@ class BarcodeDetector:
         Limpia recursos y muestra resumen final
         """
         # Mostrar resumen final
-        self.display_manager.print_final_summary(self.storage.detected_codes)
+        self.display_manager.print_final_summary(
+            self.storage.detected_codes,
+            self.storage.valid_codes,
+            self.storage.invalid_codes
+        )
 
         # Mostrar estadísticas finales
         stats = self.storage.get_statistics()
@@ -245,6 +363,7 @@ class BarcodeDetector:
 
         # Liberar recursos
         self.camera_manager.release()
+        self.image_processor.close()
         self.display_manager.cleanup()
         self.is_running = False
 
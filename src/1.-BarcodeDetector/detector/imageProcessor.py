@@ -4,68 +4,438 @@ Módulo para procesamiento de imágenes y mejora de detección
 """
 
 import cv2
+import hashlib
+import os
+import threading
 import numpy as np
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
 from pyzbar import pyzbar
+from pyzbar.locations import Point, Rect
 from config import IMAGE_PROCESSING, DETECTION_CONFIG
 
+# Decodificador zxing-cpp (opcional, más rápido que zbar); si no está
+# instalado se usa pyzbar
+try:
+    import zxingcpp
+except ImportError:
+    zxingcpp = None
+
+# Nombre del formato en zxing-cpp para cada símbolo de pyzbar
+ZXING_FORMATS = {
+    'EAN13': 'EAN13',
+    'UPCA': 'UPCA',
+    'CODE128': 'Code128',
+}
+
 
 class ImageProcessor:
     """
     Clase para procesar imágenes y mejorar la detección de códigos de barras
     """
 
+    # Gris, gaussiano, CLAHE, binarización, morfológico y bilateral
+    VARIANT_COUNT = 6
+
     def __init__(self):
         self.config = IMAGE_PROCESSING
         self.detection_config = DETECTION_CONFIG
 
-    def preprocess_frame(self, frame):
+        # Objetos reutilizados entre frames (evita reconstruirlos en cada uno)
+        self._clahe = cv2.createCLAHE(
+            clipLimit=self.config['clahe_clip_limit'],
+            tileGridSize=self.config['clahe_tile_grid_size']
+        )
+        self._morph_kernel = np.ones(
+            self.config['morphology_kernel_size'], np.uint8)
+
+        # Parámetros que se consultan en cada frame, leídos una sola vez
+        config = self.config
+        self._gaussian_ksize = config['gaussian_kernel_size']
+        self._at_max = config['adaptive_threshold_max_value']
+        self._at_block = config['adaptive_threshold_block_size']
+        self._at_c = config['adaptive_threshold_c']
+        self._bf = (config['bilateral_filter_d'],
+                    config['bilateral_filter_sigma_color'],
+                    config['bilateral_filter_sigma_space'])
+        self._contrast_threshold = config['contrast_std_threshold']
+        self._use_bilateral = config['use_bilateral']
+
+        detection = self.detection_config
+        self._scales = detection['scales']
+        self._downsample_threshold = detection['downsample_threshold']
+        self._supported = frozenset(detection['supported_symbols'])
+        self._use_roi = detection['use_roi']
+        self._roi_levels = detection['roi_pyramid_levels']
+        self._roi_threshold = detection['roi_gradient_threshold']
+        self._roi_padding = detection['roi_padding']
+        self._large_barcode_area = detection['large_barcode_area']
+        self._hit_decay_interval = detection['hit_decay_interval']
+        self._hit_decay_factor = detection['hit_decay_factor']
+
+        # T-API de OpenCV: si hay un dispositivo OpenCL, los filtros por
+        # píxel se ejecutan en la GPU y solo se descarga lo que va a pyzbar
+        self._use_umat = False
+        if self.config['use_opencl']:
+            cv2.ocl.setUseOpenCL(True)
+            self._use_umat = cv2.ocl.haveOpenCL()
+
+        # Factor para llevar frames de 16 bits a 8 bits antes de CLAHE
+        # (histogramas de 256 entradas en lugar de 65536) y de pyzbar
+        self._depth_scale = 1.0 / (1 << (self.config['input_bit_depth'] - 8))
+
+        # Símbolos específicos para medicamentos (se construyen una vez)
+        self._symbols = tuple(
+            getattr(pyzbar.ZBarSymbol, name)
+            for name in self.detection_config['supported_symbols']
+        )
+
+        # Decodificador de las variantes: zxing-cpp si está disponible
+        self._decode = self._create_decoder()
+
+        # Buffers persistentes para las salidas de cv2 (se reutilizan entre
+        # frames en lugar de reservar memoria nueva en cada llamada)
+        self._buffers = {}
+        self._processed = []
+
+        # Pool persistente para decodificar varias escalas a la vez: más
+        # hilos que escalas o que núcleos no aportan nada
+        workers = self.detection_config['decode_workers']
+        if not workers:
+            workers = min(len(self.detection_config['scales']),
+                          os.cpu_count() or 1)
+        self._pool = ThreadPoolExecutor(max_workers=max(1, workers))
+
+        # Detector nativo de OpenCV (si la build de OpenCV lo incluye)
+        self._cv_barcode = self._create_native_detector()
+
+        # Aciertos por (variante, escala) para ordenar la búsqueda
+        self._hits = Counter()
+        self._frames_since_decay = 0
+
+        # Caché LRU de resultados por huella del frame (escenas estáticas)
+        self._scan_cache = OrderedDict()
+        self._scan_cache_size = self.detection_config['scan_cache_size']
+        self._scan_cache_lock = threading.Lock()
+
+    def _get_buffer(self, name, shape, dtype=np.uint8):
         """
-        Preprocesa el frame aplicando múltiples técnicas
+        Devuelve un buffer persistente. Se reserva solo cuando la forma
+        pedida no cabe en el ya existente; si cabe, se devuelve una vista
+        de su esquina superior izquierda. Así la región de interés, cuyo
+        tamaño cambia en cada frame, y el frame completo comparten el mismo
+        buffer sin reservar memoria nueva
 
         Args:
-            frame: Frame de la cámara
+            name: Identificador del buffer
+            shape: Forma requerida
+            dtype: Tipo de los elementos (uint8 por defecto)
 
         Returns:
-            tuple: (frame_original, lista_frames_procesados)
+            np.ndarray: Buffer (o vista) con la forma y el tipo indicados
+        """
+        buffer = self._buffers.get(name)
+        reserve = shape
+        if buffer is not None and buffer.dtype == dtype and buffer.ndim == len(shape):
+            if buffer.shape == shape:
+                return buffer
+            # Crecer lo justo para cubrir tanto la forma anterior como la nueva
+            reserve = tuple(max(have, need)
+                            for have, need in zip(buffer.shape, shape))
+            if reserve == buffer.shape:
+                return buffer[tuple(slice(0, need) for need in shape)]
+
+        buffer = np.empty(reserve, dtype)
+        self._buffers[name] = buffer
+        if reserve == shape:
+            return buffer
+        return buffer[tuple(slice(0, need) for need in shape)]
+
+    def _to_gray(self, frame, name='gray'):
         """
-        processed_frames = []
+        Convierte el frame a escala de grises de 8 bits en un buffer
+        persistente. Los frames de 16 bits (sensores de 10-12 bits) se
+        reducen a 8 bits una sola vez, aquí, en vez de en cada variante
 
-        # 1. Frame original
-        processed_frames.append(frame)
+        Args:
+            frame: Frame BGR o en escala de grises, de 8 o 16 bits
+            name: Identificador del buffer de salida
 
-        # 2. Escala de grises
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        processed_frames.append(gray)
+        Returns:
+            np.ndarray: Frame en escala de grises uint8
+        """
+        if len(frame.shape) == 3:
+            if frame.dtype == np.uint8:
+                return cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY,
+                                    dst=self._get_buffer(name, frame.shape[:2]))
+            frame = cv2.cvtColor(
+                frame, cv2.COLOR_BGR2GRAY,
+                dst=self._get_buffer(name + '_wide', frame.shape[:2], frame.dtype))
 
-        # 3. Mejora de contraste con CLAHE
-        clahe = cv2.createCLAHE(
-            clipLimit=self.config['clahe_clip_limit'],
-            tileGridSize=self.config['clahe_tile_grid_size']
-        )
-        enhanced = clahe.apply(gray)
-        processed_frames.append(enhanced)
+        if frame.dtype == np.uint8:
+            return frame
 
-        # 4. Binarización adaptativa
-        binary = cv2.adaptiveThreshold(
-            gray,
-            self.config['adaptive_threshold_max_value'],
-            cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
-            cv2.THRESH_BINARY,
-            self.config['adaptive_threshold_block_size'],
-            self.config['adaptive_threshold_c']
+        return cv2.convertScaleAbs(frame, alpha=self._depth_scale,
+                                   dst=self._get_buffer(name, frame.shape))
+
+    def _create_decoder(self):
+        """
+        Elige el decodificador según config: zxing-cpp ('auto' lo usa si
+        está instalado) o pyzbar
+
+        Returns:
+            callable: Función imagen -> lista de códigos con forma de pyzbar
+        """
+        backend = self.detection_config['decoder_backend']
+        if backend == 'pyzbar' or zxingcpp is None:
+            return self._decode_pyzbar
+
+        self._zxing_formats = tuple(
+            getattr(zxingcpp.BarcodeFormat, ZXING_FORMATS[name])
+            for name in self.detection_config['supported_symbols']
+            if name in ZXING_FORMATS
         )
-        processed_frames.append(binary)
+        self._zxing_types = {
+            ZXING_FORMATS[name].upper(): name for name in ZXING_FORMATS
+        }
+        return self._decode_zxing
+
+    def _decode_pyzbar(self, image):
+        """
+        Decodifica una imagen con pyzbar
+
+        Args:
+            image: Imagen en escala de grises
+
+        Returns:
+            list: Códigos decodificados
+        """
+        return pyzbar.decode(image, symbols=self._symbols)
+
+    def _decode_zxing(self, image):
+        """
+        Decodifica una imagen con zxing-cpp y adapta los resultados a la
+        forma de pyzbar que usa el resto del código
+
+        Args:
+            image: Imagen en escala de grises
+
+        Returns:
+            list: Códigos con la misma forma que los resultados de pyzbar
+        """
+        # El reescalado ya lo hace el barrido de escalas
+        results = zxingcpp.read_barcodes(
+            image, formats=self._zxing_formats, try_downscale=False)
+
+        barcodes = []
+        for result in results:
+            code_type = self._zxing_types.get(result.format.name.upper())
+            if code_type is None:
+                continue
+
+            position = result.position
+            polygon = [
+                Point(corner.x, corner.y) for corner in (
+                    position.top_left, position.top_right,
+                    position.bottom_right, position.bottom_left)
+            ]
+            xs = [point.x for point in polygon]
+            ys = [point.y for point in polygon]
+
+            barcodes.append(pyzbar.Decoded(
+                data=result.bytes,
+                type=code_type,
+                rect=Rect(min(xs), min(ys), max(xs) - min(xs), max(ys) - min(ys)),
+                polygon=polygon,
+                quality=1,
+                orientation=None
+            ))
+
+        return barcodes
+
+    def _create_native_detector(self):
+        """
+        Crea el detector de códigos de barras nativo de OpenCV
+
+        Returns:
+            cv2.barcode.BarcodeDetector o None si no está disponible
+        """
+        if not self.detection_config['use_opencv_detector']:
+            return None
+
+        if not hasattr(cv2, 'barcode'):
+            return None
+
+        detector = cv2.barcode.BarcodeDetector()
+        detector.setDetectorScales(
+            self.detection_config['opencv_detector_scales'])
+        detector.setDownsamplingThreshold(
+            self.detection_config['opencv_downsampling_threshold'])
+        return detector
+
+    def generate_variants(self, frame, gray=None, order=None):
+        """
+        Genera de forma perezosa las versiones preprocesadas del frame.
+        Cada variante solo se calcula si el consumidor pide la siguiente,
+        es decir, si la anterior no permitió decodificar ningún código.
+        Las variantes pueden vivir en buffers persistentes, por lo que deben
+        consumirse antes de procesar el siguiente frame
+
+        Args:
+            frame: Frame de la cámara
+            gray: Frame ya convertido a escala de grises (opcional)
+            order: Orden de los índices de variante (por defecto, el natural)
+
+        Yields:
+            Frame procesado
+        """
+        if gray is None:
+            gray = self._to_gray(frame)
+
+        if order is None:
+            order = range(self.VARIANT_COUNT)
+
+        built = {}
+        for index in order:
+            yield self._build_variant(index, gray, built)
+
+    def _build_variant(self, index, gray, built):
+        """
+        Calcula una variante preprocesada (como mucho una vez por frame)
+
+        Args:
+            index: Índice de la variante (0..VARIANT_COUNT-1)
+            gray: Frame en escala de grises
+            built: Variantes ya calculadas para este frame
+
+        Returns:
+            Frame procesado
+        """
+        if index in built:
+            return built[index]
+
+        # Entrada de los filtros: el propio frame o su copia en el dispositivo
+        source = self._device_input(gray, built)
+
+        if index == 0:
+            # 1. Escala de grises sin filtrar (pyzbar umbraliza por su cuenta;
+            #    equivale al frame original, que se decodificaba en gris)
+            variant = gray
+
+        elif index == 1:
+            # 2. Suavizado gaussiano ligero
+            variant = cv2.GaussianBlur(
+                source,
+                self._gaussian_ksize,
+                0,
+                dst=self._host_buffer('blurred', gray.shape)
+            )
+
+        elif index == 2:
+            # 3. Mejora de contraste con CLAHE
+            variant = self._clahe.apply(
+                source, dst=self._host_buffer('enhanced', gray.shape))
+
+        elif index == 3:
+            # 4. Binarización adaptativa
+            variant = cv2.adaptiveThreshold(
+                source,
+                self._at_max,
+                cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+                cv2.THRESH_BINARY,
+                self._at_block,
+                self._at_c,
+                dst=self._host_buffer('binary', gray.shape)
+            )
+            # La morfología parte de la binarización sin descargarla
+            built['binary_device'] = variant
+
+        elif index == 4:
+            # 5. Operaciones morfológicas sobre la binarización
+            self._build_variant(3, gray, built)
+            variant = cv2.morphologyEx(
+                built['binary_device'], cv2.MORPH_CLOSE, self._morph_kernel,
+                dst=self._host_buffer('morph', gray.shape))
+
+        else:
+            # 6. Último recurso: filtro bilateral (el más caro con diferencia).
+            #    Desactivado, sería el mismo suavizado gaussiano de la variante 2
+            if self._use_bilateral:
+                variant = self.apply_bilateral_filter(gray)
+            else:
+                variant = self._build_variant(1, gray, built)
+
+        # pyzbar necesita arrays de numpy: descargar solo el resultado
+        if isinstance(variant, cv2.UMat):
+            variant = variant.get()
+
+        built[index] = variant
+        return variant
+
+    def _device_input(self, gray, built):
+        """
+        Devuelve la entrada de los filtros: con OpenCL, el frame subido una
+        sola vez al dispositivo como cv2.UMat; sin él, el propio frame
+
+        Args:
+            gray: Frame en escala de grises
+            built: Variantes ya calculadas para este frame
+
+        Returns:
+            np.ndarray o cv2.UMat: Entrada para los filtros
+        """
+        if not self._use_umat:
+            return gray
+
+        device = built.get('device')
+        if device is None:
+            device = cv2.UMat(gray)
+            built['device'] = device
+        return device
+
+    def _host_buffer(self, name, shape):
+        """
+        Buffer de salida para un filtro: persistente en CPU, o None con
+        OpenCL para que OpenCV reserve la salida en el dispositivo
+
+        Args:
+            name: Identificador del buffer
+            shape: Forma requerida
+
+        Returns:
+            np.ndarray o None
+        """
+        if self._use_umat:
+            return None
+        return self._get_buffer(name, shape)
+
+    def preprocess_frame(self, frame):
+        """
+        Preprocesa el frame aplicando múltiples técnicas
+
+        Args:
+            frame: Frame de la cámara
 
-        # 5. Operaciones morfológicas
-        kernel = np.ones(self.config['morphology_kernel_size'], np.uint8)
-        morph = cv2.morphologyEx(binary, cv2.MORPH_CLOSE, kernel)
-        processed_frames.append(morph)
+        Returns:
+            tuple: (frame_original, lista_frames_procesados). El primer
+            elemento de la lista es una copia del frame original y le siguen
+            las variantes en escala de grises. La lista y los frames que
+            contiene se reutilizan en la siguiente llamada
+        """
+        # Copia del frame en un buffer persistente: el llamador puede
+        # reutilizar el suyo mientras se consume la lista
+        original = self._get_buffer('original', frame.shape, frame.dtype)
+        np.copyto(original, frame)
 
-        return frame, processed_frames
+        self._processed[:] = [original]
+        self._processed.extend(self.generate_variants(frame))
+        return frame, self._processed
 
     def apply_bilateral_filter(self, frame):
         """
-        Aplica filtro bilateral para reducir ruido manteniendo bordes
+        Aplica filtro bilateral para reducir ruido manteniendo bordes. Si
+        está desactivado en config, aplica un suavizado gaussiano, mucho
+        más barato y suficiente para decodificar
 
         Args:
             frame: Frame a filtrar
@@ -73,62 +443,417 @@ class ImageProcessor:
         Returns:
             Frame filtrado
         """
-        if len(frame.shape) == 3:
-            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        else:
-            gray = frame
+        gray = self._to_gray(frame, 'filter_gray')
+
+        if not self._use_bilateral:
+            return cv2.GaussianBlur(
+                gray, self._gaussian_ksize, 0,
+                dst=self._get_buffer('filtered', gray.shape))
 
         return cv2.bilateralFilter(
             gray,
-            self.config['bilateral_filter_d'],
-            self.config['bilateral_filter_sigma_color'],
-            self.config['bilateral_filter_sigma_space']
+            *self._bf,
+            dst=self._get_buffer('filtered', gray.shape)
         )
 
-    def detect_with_multiple_scales(self, frame):
+    def detect_with_multiple_scales(self, frame, scales=None):
         """
         Detecta códigos de barras usando múltiples escalas
 
         Args:
             frame: Frame a procesar
+            scales: Escalas a probar, en orden (por defecto las de config)
 
         Returns:
             tuple: (lista_barcodes, factor_escala_usado)
         """
-        # Aplicar filtro bilateral
-        filtered = self.apply_bilateral_filter(frame)
+        barcodes, scale, base_factor = self._sweep_scales(frame, scales)
+        return barcodes, scale * base_factor
 
-        # Símbolos específicos para medicamentos
-        symbols = [
-            pyzbar.ZBarSymbol.EAN13,
-            pyzbar.ZBarSymbol.UPCA,
-            pyzbar.ZBarSymbol.CODE128
-        ]
+    def _sweep_scales(self, frame, scales=None, halve=False):
+        """
+        Barre las escalas sobre la imagen reducida a resolución de trabajo
 
-        # Probar diferentes escalas
-        for scale in self.detection_config['scales']:
-            try:
-                if scale != 1.0:
-                    height, width = filtered.shape
-                    new_width = int(width * scale)
-                    new_height = int(height * scale)
-
-                    if new_width > 0 and new_height > 0:
-                        scaled = cv2.resize(filtered, (new_width, new_height))
-                        barcodes = pyzbar.decode(scaled, symbols=symbols)
-                    else:
-                        continue
-                else:
-                    barcodes = pyzbar.decode(filtered, symbols=symbols)
+        Args:
+            frame: Frame a procesar
+            scales: Escalas a probar, en orden (por defecto las de config)
+            halve: Reducir además a la mitad (códigos grandes en imagen)
 
+        Returns:
+            tuple: (lista_barcodes, escala_nominal, factor_de_reducción)
+        """
+        if scales is None:
+            scales = self._scales
+
+        # El filtrado ya lo aportan las variantes; aquí solo hace falta gris
+        filtered = self._to_gray(frame, 'filter_gray')
+
+        # Reducir una sola vez a la resolución de trabajo: mientras el lado
+        # menor supere el umbral se divide a la mitad (1280x720 -> 640x360).
+        # Las escalas se prueban después sobre esta imagen reducida
+        threshold = self._downsample_threshold
+        height, width = filtered.shape
+        base_factor = 0.5 if halve else 1.0
+        while min(height, width) * base_factor > threshold:
+            base_factor *= 0.5
+
+        if base_factor != 1.0:
+            working_size = (int(width * base_factor), int(height * base_factor))
+            filtered = cv2.resize(
+                filtered, working_size, interpolation=cv2.INTER_AREA,
+                dst=self._get_buffer('working', working_size[::-1]))
+
+        # Reescalar primero en este hilo (cv2.resize es rápido) y lanzar
+        # después solo las decodificaciones, que liberan el GIL; así los
+        # hilos del pool no tocan el diccionario de buffers
+        futures = {
+            self._pool.submit(self._decode, scaled): scale
+            for scale, scaled in self._resize_scales(filtered, scales)
+        }
+
+        try:
+            for future in as_completed(futures):
+                try:
+                    barcodes = future.result()
+                except Exception:
+                    continue
                 if barcodes:
-                    return barcodes, scale
+                    return barcodes, futures[future], base_factor
+        finally:
+            # Cancelar las escalas pendientes y esperar a las que ya están en
+            # marcha, porque escriben en buffers que reutiliza la siguiente llamada
+            for future in futures:
+                future.cancel()
+            wait(futures)
+
+        return [], 1.0, 1.0
+
+    def _resize_scales(self, filtered, scales):
+        """
+        Precalcula la imagen reescalada para cada escala. Cada escala usa
+        su propio buffer, por lo que pueden decodificarse en paralelo
+
+        Args:
+            filtered: Imagen en escala de grises
+            scales: Escalas a aplicar
+
+        Returns:
+            list: Pares (escala, imagen) con las escalas válidas
+        """
+        height, width = filtered.shape
+        resized = []
+
+        for scale in scales:
+            if scale == 1.0:
+                resized.append((scale, filtered))
+                continue
+
+            new_width = int(width * scale)
+            new_height = int(height * scale)
+
+            if new_width <= 0 or new_height <= 0:
+                continue
 
-            except Exception as e:
+            scaled = cv2.resize(
+                filtered, (new_width, new_height),
+                dst=self._get_buffer(('scaled', scale), (new_height, new_width)))
+            resized.append((scale, scaled))
+
+        return resized
+
+    def detect_native(self, gray):
+        """
+        Detecta y decodifica códigos con el detector nativo de OpenCV
+
+        Args:
+            gray: Frame en escala de grises
+
+        Returns:
+            list: Códigos con la misma forma que los resultados de pyzbar
+        """
+        if self._cv_barcode is None:
+            return []
+
+        try:
+            ok, decoded, types, points = self._cv_barcode.detectAndDecodeWithType(
+                gray)
+        except cv2.error:
+            return []
+
+        if not ok:
+            return []
+
+        barcodes = []
+        for data, code_type, corners in zip(decoded, types, points):
+            # OpenCV usa nombres como 'EAN_13'; pyzbar usa 'EAN13'
+            code_type = code_type.replace('_', '')
+            if not data or code_type not in self._supported:
                 continue
 
+            x, y, w, h = cv2.boundingRect(corners.astype(np.int32))
+            barcodes.append(pyzbar.Decoded(
+                data=data.encode('utf-8'),
+                type=code_type,
+                rect=Rect(x, y, w, h),
+                polygon=[Point(int(px), int(py)) for px, py in corners],
+                quality=1,
+                orientation=None
+            ))
+
+        return barcodes
+
+    def _frame_key(self, frame):
+        """
+        Calcula una huella rápida del frame a partir de una miniatura. Se
+        hace sobre el frame original para no convertir a gris en los frames
+        que acaban saliendo de la caché
+
+        Args:
+            frame: Frame de la cámara (BGR o en escala de grises)
+
+        Returns:
+            bytes: Huella de 8 bytes
+        """
+        thumbnail = cv2.resize(
+            frame, (32, 18), interpolation=cv2.INTER_AREA,
+            dst=self._get_buffer('thumbnail', (18, 32) + frame.shape[2:], frame.dtype))
+        return hashlib.blake2b(thumbnail.tobytes(), digest_size=8).digest()
+
+    def detect_barcodes(self, frame):
+        """
+        Busca códigos de barras probando las variantes preprocesadas del frame.
+        Si la escena no ha cambiado respecto a un frame reciente, reutiliza
+        el resultado sin volver a decodificar
+
+        Args:
+            frame: Frame de la cámara
+
+        Returns:
+            tuple: (lista_barcodes, factor_escala_usado)
+        """
+        key = self._frame_key(frame)
+
+        with self._scan_cache_lock:
+            cached = self._scan_cache.get(key)
+            if cached is not None:
+                self._scan_cache.move_to_end(key)
+                return cached
+
+        gray = self._to_gray(frame)
+
+        # Primero una única pasada del detector nativo (multiescala en C++)
+        barcodes = self.detect_native(gray)
+        result = (barcodes, 1.0)
+
+        # Si no encuentra nada, recurrir a pyzbar sobre las variantes
+        # (cubre CODE128 y los casos difíciles), empezando por las
+        # combinaciones variante/escala que más han acertado últimamente.
+        # Primero solo en la región con textura de código de barras y, si
+        # falla, en el frame completo
+        if not barcodes and self._use_roi:
+            roi = self._find_barcode_roi(gray)
+            if roi is not None:
+                x, y, w, h = roi
+                crop = gray[y:y + h, x:x + w]
+
+                # Un código que ocupa buena parte del frame (cámara muy cerca)
+                # se decodifica igual a mitad de resolución, con 4x menos píxeles
+                height, width = gray.shape
+                halve = w * h > self._large_barcode_area * width * height
+
+                barcodes, scale = self._detect_by_prior_success(
+                    crop, crop, halve=halve)
+                if barcodes:
+                    result = (self._offset_barcodes(barcodes, x, y, scale), scale)
+
+        if not barcodes:
+            result = self._detect_by_prior_success(frame, gray)
+
+        with self._scan_cache_lock:
+            self._scan_cache[key] = result
+            if len(self._scan_cache) > self._scan_cache_size:
+                self._scan_cache.popitem(last=False)
+
+        return result
+
+    def _find_barcode_roi(self, gray):
+        """
+        Localiza la región con más probabilidad de contener un código de
+        barras: zonas con mucho gradiente horizontal y poco vertical. La
+        búsqueda se hace en la pirámide, a 1/4 de resolución, y la región se
+        lleva después a la resolución original
+
+        Args:
+            gray: Frame en escala de grises
+
+        Returns:
+            tuple: (x, y, w, h) de la región con margen, o None si no hay
+        """
+        levels = self._roi_levels
+        small = gray
+        for level in range(levels):
+            height, width = small.shape
+            small = cv2.pyrDown(small, dst=self._get_buffer(
+                ('pyramid', level), ((height + 1) // 2, (width + 1) // 2)))
+        factor = 1 << levels
+        shape = small.shape
+
+        # Respuesta de textura de barras: |gx| - |gy| promediado por zonas
+        sobel = self._get_buffer('roi_sobel', shape, np.int16)
+        grad_x = cv2.convertScaleAbs(
+            cv2.Sobel(small, cv2.CV_16S, 1, 0, ksize=3, dst=sobel),
+            dst=self._get_buffer('roi_grad_x', shape))
+        grad_y = cv2.convertScaleAbs(
+            cv2.Sobel(small, cv2.CV_16S, 0, 1, ksize=3, dst=sobel),
+            dst=self._get_buffer('roi_grad_y', shape))
+        texture = cv2.subtract(grad_x, grad_y, dst=grad_x)
+        response = cv2.boxFilter(texture, -1, (16, 16),
+                                 dst=self._get_buffer('roi_response', shape))
+
+        # Zona de máxima respuesta; si es débil no hay código a la vista
+        threshold = self._roi_threshold
+        _, max_value, _, max_location = cv2.minMaxLoc(response)
+        if max_value < threshold:
+            return None
+
+        # La región es la mancha conexa sobre el umbral que contiene el máximo
+        _, mask = cv2.threshold(response, threshold, 255, cv2.THRESH_BINARY,
+                                dst=self._get_buffer('roi_mask', shape))
+        contours, _ = cv2.findContours(
+            mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+        region = next(
+            (contour for contour in contours
+             if cv2.pointPolygonTest(contour, max_location, False) >= 0),
+            None)
+        if region is None:
+            return None
+
+        x, y, w, h = (value * factor for value in cv2.boundingRect(region))
+        height, width = gray.shape
+
+        # Regiones diminutas no son códigos; regiones enormes (ruido, texturas)
+        # no ahorran nada frente al frame completo
+        if w < 20 or h < 10 or w * h > 0.5 * width * height:
+            return None
+
+        # Añadir margen para no cortar las zonas de silencio del código
+        padding = self._roi_padding
+        pad_x = int(w * padding)
+        pad_y = int(h * padding)
+        x_start = max(0, x - pad_x)
+        y_start = max(0, y - pad_y)
+        x_end = min(width, x + w + pad_x)
+        y_end = min(height, y + h + pad_y)
+
+        return x_start, y_start, x_end - x_start, y_end - y_start
+
+    @staticmethod
+    def _offset_barcodes(barcodes, offset_x, offset_y, scale):
+        """
+        Traslada los códigos detectados en un recorte a coordenadas del frame
+
+        Args:
+            barcodes: Códigos detectados en el recorte
+            offset_x: Desplazamiento horizontal del recorte
+            offset_y: Desplazamiento vertical del recorte
+            scale: Escala a la que se detectaron (las coordenadas están escaladas)
+
+        Returns:
+            list: Códigos con rect y polígono en coordenadas del frame escalado
+        """
+        dx = int(round(offset_x * scale))
+        dy = int(round(offset_y * scale))
+
+        return [
+            barcode._replace(
+                rect=Rect(barcode.rect.left + dx, barcode.rect.top + dy,
+                          barcode.rect.width, barcode.rect.height),
+                polygon=[Point(px + dx, py + dy) for px, py in barcode.polygon]
+            )
+            for barcode in barcodes
+        ]
+
+    def _candidate_variants(self, gray):
+        """
+        Elige una sola rama de mejora según el contraste del frame: CLAHE
+        para imágenes de poco contraste, binarización + morfología para el
+        resto. Así no se recorre el frame completo con ambas
+
+        Args:
+            gray: Frame en escala de grises
+
+        Returns:
+            list: Índices de las variantes a probar
+        """
+        _, std_dev = cv2.meanStdDev(gray)
+
+        if std_dev[0][0] < self._contrast_threshold:
+            skipped = (3, 4)
+        else:
+            skipped = (2,)
+
+        # Sin filtro bilateral la última variante repite la gaussiana
+        if not self._use_bilateral:
+            skipped += (5,)
+
+        return [index for index in range(self.VARIANT_COUNT)
+                if index not in skipped]
+
+    def _detect_by_prior_success(self, frame, gray, halve=False):
+        """
+        Prueba las variantes y escalas ordenadas por aciertos recientes
+
+        Args:
+            frame: Frame de la cámara
+            gray: Frame en escala de grises
+            halve: Reducir además a la mitad antes de decodificar
+
+        Returns:
+            tuple: (lista_barcodes, factor_escala_usado)
+        """
+        # Olvidar poco a poco los aciertos antiguos para adaptarse a la escena
+        self._frames_since_decay += 1
+        if self._frames_since_decay >= self._hit_decay_interval:
+            decay = self._hit_decay_factor
+            for key in self._hits:
+                self._hits[key] *= decay
+            self._frames_since_decay = 0
+
+        scales = self._scales
+        variant_hits = Counter()
+        for (index, scale), hits in self._hits.items():
+            variant_hits[index] += hits
+
+        # sorted es estable: sin aciertos se mantiene el orden por defecto
+        order = sorted(self._candidate_variants(gray),
+                       key=lambda index: -variant_hits[index])
+
+        variants = self.generate_variants(frame, gray, order)
+        for index, processed_frame in zip(order, variants):
+            ordered_scales = sorted(
+                scales, key=lambda scale: -self._hits[(index, scale)])
+            barcodes, scale, base_factor = self._sweep_scales(
+                processed_frame, ordered_scales, halve)
+            if barcodes:
+                self._hits[(index, scale)] += 1
+                return barcodes, scale * base_factor
+
         return [], 1.0
 
+    def close(self):
+        """
+        Libera el pool de hilos de decodificación
+        """
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+    def clear_scan_cache(self):
+        """
+        Vacía la caché de resultados de escaneo
+        """
+        with self._scan_cache_lock:
+            self._scan_cache.clear()
+
     def enhance_barcode_region(self, frame, barcode_rect):
         """
         Mejora específicamente la región donde se detectó un código de barras
@@ -142,15 +867,12 @@ class ImageProcessor:
         """
         x, y, w, h = barcode_rect
 
-        # Expandir la región ligeramente
+        # Expandir la región ligeramente. El slicing de numpy ya recorta los
+        # límites superiores; solo hay que evitar índices negativos, que
+        # numpy interpretaría desde el final
         padding = 10
-        x_start = max(0, x - padding)
-        y_start = max(0, y - padding)
-        x_end = min(frame.shape[1], x + w + padding)
-        y_end = min(frame.shape[0], y + h + padding)
-
-        # Extraer región
-        region = frame[y_start:y_end, x_start:x_end]
+        region = frame[max(0, y - padding):y + h + padding,
+                       max(0, x - padding):x + w + padding]
 
         if len(region.shape) == 3:
             region = cv2.cvtColor(region, cv2.COLOR_BGR2GRAY)
@@ -3,12 +3,58 @@
 Módulo para validación de códigos de barras
 """
 
+import numpy as np
+
+# Tabla ASCII -> valor del dígito (-1 para caracteres que no son dígitos)
+_DIGIT_TABLE = np.full(256, -1, dtype=np.int32)
+_DIGIT_TABLE[ord('0'):ord('9') + 1] = np.arange(10)
+
+# Pesos fijos del dígito de control UPC-A (se aplican con un producto escalar)
+_W_UPCA = np.array([3, 1, 3, 1, 3, 1, 3, 1, 3, 1, 3], dtype=np.int32)
+
+
+def _to_digits(code, length):
+    """
+    Convierte un código ASCII en un array de dígitos
+
+    Args:
+        code (str): Código a convertir
+        length (int): Longitud esperada
+
+    Returns:
+        np.ndarray: Dígitos del código, o None si no es válido
+    """
+    if len(code) != length or not code.isascii():
+        return None
+
+    digits = _DIGIT_TABLE[np.frombuffer(code.encode('ascii'), np.uint8)]
+
+    # Verificar que solo contenga dígitos
+    if (digits < 0).any():
+        return None
+
+    return digits
+
+
+# Constantes para el cálculo SWAR del EAN-13: los dígitos ASCII se cargan
+# empaquetados en un entero (un byte por dígito) y se operan todos a la vez
+_ASCII_ZEROS_8 = int.from_bytes(b'0' * 8, 'little')
+_ASCII_ZEROS_4 = int.from_bytes(b'0' * 4, 'little')
+_EVEN_LANES = 0x00FF00FF00FF00FF
+_LANE_SUM = 0x0001000100010001
+
 
 class BarcodeValidator:
     """
     Clase para validar diferentes tipos de códigos de barras
     """
 
+    # Tipos de código habituales en farmacia
+    _PHARMA_TYPES = frozenset({'EAN13', 'UPCA', 'CODE128'})
+
+    # Prefijos comunes de EAN-13 para productos farmacéuticos
+    _PHARMA_PREFIXES = ('84', '76', '77', '80', '81', '82', '83')
+
     @staticmethod
     def is_valid_ean13(code):
         """
@@ -20,20 +66,29 @@ class BarcodeValidator:
         Returns:
             bool: True si es válido, False en caso contrario
         """
-        # Verificar longitud
-        if len(code) != 13:
+        # Verificar longitud y que solo contenga dígitos ASCII
+        if len(code) != 13 or not code.isascii():
             return False
 
-        # Verificar que solo contenga dígitos
-        if not code.isdigit():
+        data = code.encode('ascii')
+        if not data.isdigit():
             return False
 
+        # Dígitos 0-7 y 8-11 empaquetados, un byte por dígito
+        low = int.from_bytes(data[:8], 'little') - _ASCII_ZEROS_8
+        high = int.from_bytes(data[8:12], 'little') - _ASCII_ZEROS_4
+
+        # Cada carril de 16 bits suma posición par + 3 * posición impar
+        lanes = ((low & _EVEN_LANES) + 3 * ((low >> 8) & _EVEN_LANES) +
+                 (high & _EVEN_LANES) + 3 * ((high >> 8) & _EVEN_LANES))
+
+        # Suma horizontal de los cuatro carriles en los 16 bits altos
+        total = ((lanes * _LANE_SUM) >> 48) & 0xFFFF
+
         # Calcular dígito de control EAN-13
-        odd_sum = sum(int(code[i]) for i in range(0, 12, 2))
-        even_sum = sum(int(code[i]) for i in range(1, 12, 2))
-        checksum = (10 - ((odd_sum + even_sum * 3) % 10)) % 10
+        checksum = (10 - (total % 10)) % 10
 
-        return checksum == int(code[12])
+        return checksum == data[12] - 48
 
     @staticmethod
     def is_valid_upca(code):
@@ -46,18 +101,14 @@ class BarcodeValidator:
         Returns:
             bool: True si es válido, False en caso contrario
         """
-        if len(code) != 12:
-            return False
-
-        if not code.isdigit():
+        digits = _to_digits(code, 12)
+        if digits is None:
             return False
 
         # Algoritmo de validación UPC-A
-        odd_sum = sum(int(code[i]) for i in range(0, 11, 2))
-        even_sum = sum(int(code[i]) for i in range(1, 11, 2))
-        checksum = (10 - ((odd_sum * 3 + even_sum) % 10)) % 10
+        checksum = (10 - int(digits[:11] @ _W_UPCA) % 10) % 10
 
-        return checksum == int(code[11])
+        return checksum == int(digits[11])
 
     @staticmethod
     def validate_code(code, code_type):
@@ -96,15 +147,11 @@ class BarcodeValidator:
         Returns:
             bool: True si es típico de farmacia
         """
-        pharmaceutical_types = ['EAN13', 'UPCA', 'CODE128']
-
-        if code_type not in pharmaceutical_types:
+        if code_type not in BarcodeValidator._PHARMA_TYPES:
             return False
 
         # Los códigos EAN-13 de medicamentos en España suelen comenzar con ciertos prefijos
         if code_type == 'EAN13' and len(code) == 13:
-            # Prefijos comunes para productos farmacéuticos
-            pharma_prefixes = ['84', '76', '77', '80', '81', '82', '83']
-            return any(code.startswith(prefix) for prefix in pharma_prefixes)
+            return code.startswith(BarcodeValidator._PHARMA_PREFIXES)
 
         return True  # Otros tipos los consideramos válidos por defecto
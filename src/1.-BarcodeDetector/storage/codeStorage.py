@@ -4,9 +4,17 @@ Gestión y almacenamiento de códigos detectados
 """
 
 import json
+import time
+from collections import Counter, defaultdict, deque
 from datetime import datetime
 from typing import List, Dict, Optional
-from config import DETECTION_CONFIG, LOGGING_CONFIG
+from config import DETECTION_CONFIG, LOGGING_CONFIG, STORAGE_CONFIG
+
+# Serializador JSON en C (opcional); si no está instalado se usa json
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 
 class CodeStorage:
@@ -14,12 +22,39 @@ class CodeStorage:
     Gestiona el almacenamiento y recuperación de códigos detectados
     """
 
+    # Tipos de código habituales en farmacia
+    _PHARMA_TYPES = frozenset({'EAN13', 'UPCA', 'CODE128'})
+
     def __init__(self):
-        self.detected_codes = []
-        self.last_barcode = None
-        self.last_detection_time = None
+        # Historial acotado: los códigos más antiguos se descartan al llenarse
+        max_history = STORAGE_CONFIG['max_history']
+        self.detected_codes = deque(maxlen=max_history)
+
+        # Columnas paralelas al historial con los campos por los que se
+        # filtra y agrupa, para recorrerlas sin buscar claves en cada dict.
+        # Al compartir maxlen se descartan a la vez que el historial
+        self._codes = deque(maxlen=max_history)
+        self._valid = deque(maxlen=max_history)
+        self._pharmaceutical = deque(maxlen=max_history)
+        # Instante (reloj monotónico) de cada código, para filtrar por
+        # antigüedad sin parsear timestamps
+        self._detected_at = deque(maxlen=max_history)
+
+        # Historial ya separado en válidos e inválidos, en orden de llegada,
+        # para el resumen final sin recorrer todo el historial
+        self.valid_codes = deque()
+        self.invalid_codes = deque()
         self.cooldown_seconds = DETECTION_CONFIG['cooldown_seconds']
 
+        # Última vez (reloj monotónico) que se procesó cada código, para que
+        # varios códigos a la vista no se pisen el cooldown entre sí
+        self._last_seen = {}
+        self._calls_since_sweep = 0
+
+        # Contadores mantenidos al insertar, para estadísticas en O(1)
+        self._counters = Counter()
+        self._type_counts = Counter()
+
     def should_process_detection(self, barcode_data: str) -> bool:
         """
         Verifica si debe procesar una nueva detección (evita duplicados)
@@ -30,18 +65,30 @@ class CodeStorage:
         Returns:
             True si debe procesar, False en caso contrario
         """
-        current_time = datetime.now()
+        now = time.monotonic()
 
-        if (self.last_barcode != barcode_data or
-            self.last_detection_time is None or
-                (current_time - self.last_detection_time).total_seconds() > self.cooldown_seconds):
+        # Purgar periódicamente los códigos cuyo cooldown ya expiró
+        self._calls_since_sweep += 1
+        if self._calls_since_sweep >= 256:
+            self._sweep_last_seen(now)
 
-            self.last_barcode = barcode_data
-            self.last_detection_time = current_time
+        last_seen = self._last_seen.get(barcode_data)
+        if last_seen is None or now - last_seen > self.cooldown_seconds:
+            self._last_seen[barcode_data] = now
             return True
 
         return False
 
+    def _sweep_last_seen(self, now: float):
+        """
+        Elimina del registro de cooldown los códigos que ya expiraron
+        """
+        self._last_seen = {
+            code: seen for code, seen in self._last_seen.items()
+            if now - seen <= self.cooldown_seconds
+        }
+        self._calls_since_sweep = 0
+
     def add_detected_code(self, code_data: str, code_type: str, is_valid: bool = True,
                           extra_info: Optional[Dict] = None) -> Dict:
         """
@@ -70,15 +117,63 @@ class CodeStorage:
         if extra_info:
             detection_info.update(extra_info)
 
-        self.detected_codes.append(detection_info)
+        self._append_code(detection_info, time.monotonic())
         return detection_info
 
+    def _append_code(self, code_info: Dict, detected_at: float):
+        """
+        Añade un código al historial manteniendo los contadores al día
+        """
+        # Si el historial está lleno, el más antiguo se descarta al añadir
+        if len(self.detected_codes) == self.detected_codes.maxlen:
+            self._update_counters(self.detected_codes[0], -1)
+            # El más antiguo del historial es también el primero de su grupo
+            if self._valid[0]:
+                self.valid_codes.popleft()
+            else:
+                self.invalid_codes.popleft()
+
+        self.detected_codes.append(code_info)
+        self._codes.append(code_info.get('codigo'))
+        is_valid = bool(code_info.get('valido', False))
+        self._valid.append(is_valid)
+        (self.valid_codes if is_valid else self.invalid_codes).append(code_info)
+        self._pharmaceutical.append(bool(code_info.get('es_farmaceutico', False)))
+        self._detected_at.append(detected_at)
+        self._update_counters(code_info, 1)
+
+    @staticmethod
+    def _monotonic_from_timestamp(timestamp: str) -> float:
+        """
+        Traduce un timestamp de texto (p. ej. de un JSON importado) al reloj
+        monotónico. Se hace una sola vez, al importar
+
+        Returns:
+            Instante monotónico equivalente (-inf si no se puede interpretar)
+        """
+        try:
+            wall_time = datetime.strptime(
+                timestamp, LOGGING_CONFIG['date_format']).timestamp()
+        except (TypeError, ValueError):
+            return float('-inf')
+
+        return time.monotonic() - (time.time() - wall_time)
+
+    def _update_counters(self, code_info: Dict, delta: int):
+        """
+        Suma (o resta) un código a los contadores de estadísticas
+        """
+        if code_info.get('valido', False):
+            self._counters['valid'] += delta
+        if code_info.get('es_farmaceutico', False):
+            self._counters['pharmaceutical'] += delta
+        self._type_counts[code_info.get('tipo', 'Unknown')] += delta
+
     def _is_pharmaceutical_type(self, code_type: str) -> bool:
         """
         Determina si el tipo de código es típico de productos farmacéuticos
         """
-        pharmaceutical_types = ['EAN13', 'UPCA', 'CODE128']
-        return code_type in pharmaceutical_types
+        return code_type in self._PHARMA_TYPES
 
     def get_detected_codes(self, filter_valid: Optional[bool] = None,
                            filter_pharmaceutical: Optional[bool] = None) -> List[Dict]:
@@ -92,17 +187,17 @@ class CodeStorage:
         Returns:
             Lista de códigos filtrados
         """
-        codes = self.detected_codes
-
-        if filter_valid is not None:
-            codes = [code for code in codes if code.get(
-                'valido', False) == filter_valid]
-
-        if filter_pharmaceutical is not None:
-            codes = [code for code in codes if code.get(
-                'es_farmaceutico', False) == filter_pharmaceutical]
-
-        return codes
+        # Siempre una lista nueva: el historial interno no debe modificarse
+        # desde fuera, porque lo acompañan columnas paralelas y contadores
+        if filter_valid is None and filter_pharmaceutical is None:
+            return list(self.detected_codes)
+
+        return [
+            code for code, valid, pharmaceutical in zip(
+                self.detected_codes, self._valid, self._pharmaceutical)
+            if (filter_valid is None or valid == filter_valid) and
+            (filter_pharmaceutical is None or pharmaceutical == filter_pharmaceutical)
+        ]
 
     def get_statistics(self) -> Dict:
         """
@@ -112,16 +207,14 @@ class CodeStorage:
             Diccionario con estadísticas
         """
         total = len(self.detected_codes)
-        valid = len(
-            [code for code in self.detected_codes if code.get('valido', False)])
-        pharmaceutical = len(
-            [code for code in self.detected_codes if code.get('es_farmaceutico', False)])
+        valid = self._counters['valid']
+        pharmaceutical = self._counters['pharmaceutical']
 
         # Contar por tipos
-        types_count = {}
-        for code in self.detected_codes:
-            code_type = code.get('tipo', 'Unknown')
-            types_count[code_type] = types_count.get(code_type, 0) + 1
+        types_count = {
+            code_type: count
+            for code_type, count in self._type_counts.items() if count > 0
+        }
 
         return {
             'total': total,
@@ -138,8 +231,15 @@ class CodeStorage:
         Limpia el historial de códigos detectados
         """
         self.detected_codes.clear()
-        self.last_barcode = None
-        self.last_detection_time = None
+        self._codes.clear()
+        self._valid.clear()
+        self.valid_codes.clear()
+        self.invalid_codes.clear()
+        self._pharmaceutical.clear()
+        self._detected_at.clear()
+        self._last_seen.clear()
+        self._counters.clear()
+        self._type_counts.clear()
 
     def export_to_json(self, filename: str) -> bool:
         """
@@ -155,11 +255,16 @@ class CodeStorage:
             export_data = {
                 'export_timestamp': datetime.now().isoformat(),
                 'statistics': self.get_statistics(),
-                'detected_codes': self.detected_codes
+                'detected_codes': list(self.detected_codes)
             }
 
-            with open(filename, 'w', encoding='utf-8') as f:
-                json.dump(export_data, f, indent=2, ensure_ascii=False)
+            if orjson is not None:
+                with open(filename, 'wb') as f:
+                    f.write(orjson.dumps(
+                        export_data, option=orjson.OPT_INDENT_2, default=str))
+            else:
+                with open(filename, 'w', encoding='utf-8') as f:
+                    json.dump(export_data, f, indent=2, ensure_ascii=False)
 
             return True
         except Exception as e:
@@ -181,7 +286,10 @@ class CodeStorage:
                 data = json.load(f)
 
             if 'detected_codes' in data:
-                self.detected_codes.extend(data['detected_codes'])
+                for code_info in data['detected_codes']:
+                    self._append_code(
+                        code_info,
+                        self._monotonic_from_timestamp(code_info.get('timestamp')))
                 return True
 
         except Exception as e:
@@ -205,12 +313,15 @@ class CodeStorage:
                 if not self.detected_codes:
                     return True
 
-                fieldnames = self.detected_codes[0].keys()
-                writer = csv.DictWriter(f, fieldnames=fieldnames)
+                fieldnames = list(self.detected_codes[0].keys())
+                writer = csv.writer(f)
 
-                writer.writeheader()
-                for code in self.detected_codes:
-                    writer.writerow(code)
+                # Cabecera y todas las filas (como tuplas) de una vez
+                writer.writerow(fieldnames)
+                writer.writerows(
+                    tuple(code.get(field, '') for field in fieldnames)
+                    for code in self.detected_codes
+                )
 
             return True
         except Exception as e:
@@ -224,25 +335,26 @@ class CodeStorage:
         Returns:
             Lista de códigos que aparecen más de una vez
         """
-        code_counts = {}
-        duplicates = []
-
-        for code_info in self.detected_codes:
-            code = code_info['codigo']
-            if code in code_counts:
-                code_counts[code].append(code_info)
-            else:
-                code_counts[code] = [code_info]
-
-        for code, occurrences in code_counts.items():
-            if len(occurrences) > 1:
-                duplicates.append({
-                    'codigo': code,
-                    'count': len(occurrences),
-                    'occurrences': occurrences
-                })
-
-        return duplicates
+        # Contar primero y solo agrupar las apariciones de los repetidos
+        code_counts = Counter(self._codes)
+        duplicate_codes = {code for code, count in code_counts.items() if count > 1}
+
+        if not duplicate_codes:
+            return []
+
+        occurrences = defaultdict(list)
+        for code, code_info in zip(self._codes, self.detected_codes):
+            if code in duplicate_codes:
+                occurrences[code].append(code_info)
+
+        return [
+            {
+                'codigo': code,
+                'count': len(code_occurrences),
+                'occurrences': code_occurrences
+            }
+            for code, code_occurrences in occurrences.items()
+        ]
 
     def get_recent_codes(self, minutes: int = 30) -> List[Dict]:
         """
@@ -254,18 +366,9 @@ class CodeStorage:
         Returns:
             Lista de códigos recientes
         """
-        from datetime import timedelta
-
-        cutoff_time = datetime.now() - timedelta(minutes=minutes)
-        recent_codes = []
-
-        for code in self.detected_codes:
-            try:
-                code_time = datetime.strptime(
-                    code['timestamp'], LOGGING_CONFIG['date_format'])
-                if code_time >= cutoff_time:
-                    recent_codes.append(code)
-            except ValueError:
-                continue
+        cutoff = time.monotonic() - minutes * 60
 
-        return recent_codes
+        return [
+            code for code, detected_at in zip(self.detected_codes, self._detected_at)
+            if detected_at >= cutoff
+        ]
@@ -5,5 +5,6 @@ Utilidades para el detector de códigos de barras
 
 from .cameraConfig import CameraManager
 from .display import DisplayManager
+from .logger import create_queue_logger
 
-__all__ = ['CameraManager', 'DisplayManager']
+__all__ = ['CameraManager', 'DisplayManager', 'create_queue_logger']
@@ -4,6 +4,8 @@ Configuración y gestión de cámara para detección de códigos de barras
 """
 
 import cv2
+import queue
+import threading
 from config import CAMERA_CONFIG
 
 
@@ -23,6 +25,23 @@ class CameraManager:
         self.camera_index = camera_index or self.config['index']
         self.cap = None
 
+        # Propiedades leídas del driver (cada get/set es una llamada al
+        # driver de la cámara), guardadas hasta que se invaliden
+        self._info_cache = None
+        self._capabilities = None
+
+        # Captura asíncrona: un hilo lee continuamente y deja el último frame
+        # disponible; el consumidor no espera a la cámara mientras procesa
+        self._capture_thread = None
+        self._capture_stop = threading.Event()
+        self._frame_ready = threading.Condition()
+        self._latest = None
+        self._capturing = False
+
+        # Pool de buffers de frame: los frames ya consumidos o descartados
+        # se reutilizan en la siguiente captura
+        self._frame_pool = queue.Queue()
+
     def initialize_camera(self):
         """
         Inicializa y configura la cámara
@@ -48,6 +67,12 @@ class CameraManager:
         if not self.cap:
             return
 
+        # Pedir MJPEG comprimido en la propia cámara (antes de la resolución,
+        # algunos drivers lo requieren): evita saturar el USB con YUYV crudo
+        if self.config['fourcc']:
+            self.cap.set(cv2.CAP_PROP_FOURCC,
+                         cv2.VideoWriter_fourcc(*self.config['fourcc']))
+
         # Configurar resolución
         self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, self.config['width'])
         self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, self.config['height'])
@@ -55,6 +80,9 @@ class CameraManager:
         # Configurar FPS
         self.cap.set(cv2.CAP_PROP_FPS, self.config['fps'])
 
+        # Buffer mínimo para leer siempre el frame más reciente
+        self.cap.set(cv2.CAP_PROP_BUFFERSIZE, self.config['buffer_size'])
+
         # Configurar autofocus si es compatible
         if self.config['autofocus']:
             try:
@@ -68,9 +96,129 @@ class CameraManager:
         except:
             pass
 
+        # Leer una sola vez la configuración resultante
+        self._info_cache = self._read_camera_info()
+
+    def read_latest(self, image=None):
+        """
+        Lee el frame más reciente: grab() descarta sin decodificar los
+        frames encolados en el driver y retrieve() decodifica solo el último
+
+        Args:
+            image: Buffer donde escribir el frame (opcional, para reutilizarlo)
+
+        Returns:
+            tuple: (ret, frame) como cv2.VideoCapture.read
+        """
+        for _ in range(self.config['grab_count']):
+            if not self.cap.grab():
+                return False, None
+
+        return self.cap.retrieve(image)
+
+    def start_async(self, pool_size=4):
+        """
+        Arranca el hilo de captura en segundo plano
+
+        Args:
+            pool_size: Número máximo de buffers de frame reutilizables
+        """
+        if self._capture_thread is not None:
+            return
+
+        self._frame_pool = queue.Queue(maxsize=pool_size)
+        self._capture_stop.clear()
+        self._latest = None
+        self._capturing = True
+        self._capture_thread = threading.Thread(
+            target=self._capture_loop, daemon=True)
+        self._capture_thread.start()
+
+    def _capture_loop(self):
+        """
+        Hilo de captura: lee frames y sustituye el último sin consumir
+        """
+        while not self._capture_stop.is_set():
+            try:
+                buffer = self._frame_pool.get_nowait()
+            except queue.Empty:
+                buffer = None
+
+            ret, frame = self.read_latest(buffer)
+            if not ret:
+                break
+
+            with self._frame_ready:
+                # El frame que nadie llegó a leer se descarta (drop-oldest)
+                dropped, self._latest = self._latest, frame
+                self._frame_ready.notify()
+
+            if dropped is not None:
+                self.recycle_frame(dropped)
+
+        with self._frame_ready:
+            self._capturing = False
+            self._frame_ready.notify_all()
+
+    def read_async(self, timeout=None):
+        """
+        Obtiene el frame más reciente del hilo de captura. Cada frame se
+        entrega una sola vez; quien lo recibe debe devolverlo con
+        recycle_frame cuando ya no lo necesite
+
+        Args:
+            timeout: Segundos máximos de espera (None = sin límite)
+
+        Returns:
+            Frame nuevo, o None si no llega ninguno a tiempo o la captura terminó
+        """
+        with self._frame_ready:
+            if self._latest is None and self._capturing:
+                self._frame_ready.wait(timeout)
+
+            frame, self._latest = self._latest, None
+
+        return frame
+
+    def is_capturing(self):
+        """
+        Indica si el hilo de captura sigue recibiendo frames
+
+        Returns:
+            bool: True mientras la captura asíncrona esté activa
+        """
+        return self._capturing
+
+    def recycle_frame(self, frame):
+        """
+        Devuelve un buffer de frame al pool para reutilizarlo en la captura
+
+        Args:
+            frame: Frame que ya no se va a usar
+        """
+        try:
+            self._frame_pool.put_nowait(frame)
+        except queue.Full:
+            pass
+
+    def stop_async(self):
+        """
+        Detiene el hilo de captura y espera a que termine
+        """
+        self._capture_stop.set()
+        if self._capture_thread is not None:
+            self._capture_thread.join(timeout=1.0)
+            self._capture_thread = None
+
+        with self._frame_ready:
+            self._capturing = False
+            self._latest = None
+            self._frame_ready.notify_all()
+
     def get_camera_info(self):
         """
-        Obtiene información actual de la cámara
+        Obtiene información actual de la cámara (desde la caché, sin
+        consultar al driver salvo tras invalidate_info_cache)
 
         Returns:
             dict: Información de la cámara
@@ -78,6 +226,26 @@ class CameraManager:
         if not self.cap:
             return {}
 
+        if self._info_cache is None:
+            self._info_cache = self._read_camera_info()
+
+        return dict(self._info_cache)
+
+    def invalidate_info_cache(self):
+        """
+        Descarta la información y capacidades guardadas para que la próxima
+        consulta las vuelva a leer de la cámara
+        """
+        self._info_cache = None
+        self._capabilities = None
+
+    def _read_camera_info(self):
+        """
+        Lee del driver las propiedades actuales de la cámara
+
+        Returns:
+            dict: Información de la cámara
+        """
         return {
             'width': int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
             'height': int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
@@ -111,9 +279,14 @@ class CameraManager:
             # Algunas cámaras no soportan todas las propiedades
             pass
 
+        # Contraste y saturación han cambiado
+        self._info_cache = None
+
     def test_camera_capabilities(self):
         """
-        Prueba las capacidades de la cámara y reporta qué funciona
+        Prueba las capacidades de la cámara y reporta qué funciona. La
+        prueba (escribir y restaurar cada propiedad) solo se hace la
+        primera vez; después se devuelve el resultado guardado
 
         Returns:
             dict: Capacidades disponibles
@@ -121,6 +294,18 @@ class CameraManager:
         if not self.cap:
             return {}
 
+        if self._capabilities is None:
+            self._capabilities = self._probe_capabilities()
+
+        return {name: dict(info) for name, info in self._capabilities.items()}
+
+    def _probe_capabilities(self):
+        """
+        Comprueba en el driver qué propiedades se pueden leer y escribir
+
+        Returns:
+            dict: Capacidades disponibles
+        """
         capabilities = {}
         test_properties = {
             'autofocus': cv2.CAP_PROP_AUTOFOCUS,
@@ -164,6 +349,9 @@ class CameraManager:
         """
         Libera los recursos de la cámara
         """
+        self.stop_async()
+
         if self.cap:
             self.cap.release()
             self.cap = None
+        self.invalidate_info_cache()
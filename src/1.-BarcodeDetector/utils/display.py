@@ -4,7 +4,12 @@ Funciones para visualización y interfaz de usuario
 """
 
 import cv2
+import sys
+import time
+import numpy as np
+from collections import OrderedDict
 from config import UI_CONFIG, MESSAGES
+from utils.logger import create_queue_logger
 
 
 class DisplayManager:
@@ -16,6 +21,160 @@ class DisplayManager:
         self.ui_config = UI_CONFIG
         self.messages = MESSAGES
 
+        # Limitar la frecuencia de refresco de la ventana
+        self._show_interval = 1.0 / self.ui_config['display_fps']
+        self._last_show = 0.0
+
+        # Los mensajes de consola se formatean y escriben desde un hilo en
+        # segundo plano; aquí solo se eligen las plantillas
+        self.logger, self._log_listener = create_queue_logger()
+        self._detection_templates = self._build_detection_templates()
+
+        # Valores de UI_CONFIG que se usan en cada frame, leídos una sola vez
+        self._window = self.ui_config['window_name']
+        self._font = getattr(cv2, self.ui_config['font'].rsplit('.', 1)[-1],
+                             cv2.FONT_HERSHEY_SIMPLEX)
+        self._font_scale = self.ui_config['font_scale']
+        self._font_color = tuple(self.ui_config['font_color'])
+        self._font_thick = self.ui_config['font_thickness']
+        self._rect_color = tuple(self.ui_config['rectangle_color'])
+        self._rect_thick = self.ui_config['rectangle_thickness']
+        self._type_color = tuple(self.ui_config['type_color'])
+        self._label_thick = self.ui_config['label_thickness']
+
+        # Texto de información del último frame y la clave con que se generó
+        self._last_info_key = None
+        self._last_info_text = ''
+
+        # Altura del último frame y posición de las instrucciones derivada
+        self._last_h = None
+        self._instr_y = 0
+
+        # Máscaras de texto ya rasterizadas (LRU): los textos que se repiten
+        # entre frames se copian en lugar de volver a dibujarse
+        self._text_cache = OrderedDict()
+        self._text_cache_size = self.ui_config['text_cache_size']
+
+        # Valor ya decodificado de los últimos códigos vistos (LRU por bytes):
+        # un código suele aparecer en muchos frames seguidos
+        self._barcode_cache = OrderedDict()
+        self._barcode_cache_size = self.ui_config['barcode_cache_size']
+
+    def _build_detection_templates(self):
+        """
+        Prepara las plantillas %-format de los mensajes de detección. Los
+        datos del código se pasan como argumentos del registro y se
+        interpolan en el hilo de logging
+
+        Returns:
+            dict: Plantilla por tipo de mensaje ('valid', 'general', 'other')
+        """
+        detection = {key: text.replace('%', '%%')
+                     for key, text in self.messages['detection'].items()}
+        body = "\n   Código: %s\n   Tipo: %s\n   Hora: %s"
+
+        return {
+            'valid': "\n" + detection['valid_code'] + body + "\n   Total detectados: %s",
+            'general': "\n" + detection['general_code'] + body,
+            'other': "\n" + detection['general_code'] + body + "\n   " + detection['not_ean13']
+        }
+
+    def _decode_value(self, raw):
+        """
+        Decodifica el contenido de un código, reutilizando el resultado si
+        los mismos bytes se han visto recientemente
+
+        Args:
+            raw: Bytes del código (barcode.data)
+
+        Returns:
+            str: Valor del código en UTF-8
+        """
+        value = self._barcode_cache.get(raw)
+        if value is not None:
+            self._barcode_cache.move_to_end(raw)
+            return value
+
+        value = raw.decode('utf-8')
+        self._barcode_cache[raw] = value
+        if len(self._barcode_cache) > self._barcode_cache_size:
+            self._barcode_cache.popitem(last=False)
+        return value
+
+    def _get_text_patch(self, text, font, scale, color, thickness):
+        """
+        Devuelve el texto ya rasterizado (parche de color y máscara),
+        dibujándolo solo la primera vez que se pide
+
+        Args:
+            text: Texto a rasterizar
+            font: Fuente de OpenCV
+            scale: Escala de la fuente
+            color: Color BGR
+            thickness: Grosor del trazo
+
+        Returns:
+            tuple: (parche, máscara, desplazamiento x, desplazamiento y) del
+            origen del texto dentro del parche
+        """
+        key = (text, font, scale, color, thickness)
+        cached = self._text_cache.get(key)
+        if cached is not None:
+            self._text_cache.move_to_end(key)
+            return cached
+
+        (width, height), baseline = cv2.getTextSize(text, font, scale, thickness)
+
+        # Margen para el grosor del trazo alrededor del texto. Siempre LINE_8:
+        # sin antialiasing la máscara es binaria y la copia es exacta, y
+        # LINE_AA encarece mucho el rasterizado
+        pad = thickness
+        mask = np.zeros((height + baseline + 2 * pad, width + 2 * pad), np.uint8)
+        cv2.putText(mask, text, (pad, pad + height), font, scale, 255,
+                    thickness, cv2.LINE_8)
+
+        patch = np.empty(mask.shape + (3,), np.uint8)
+        patch[:] = color
+
+        cached = (patch, mask, pad, pad + height)
+        self._text_cache[key] = cached
+        if len(self._text_cache) > self._text_cache_size:
+            self._text_cache.popitem(last=False)
+        return cached
+
+    def _put_text_cached(self, frame, text, org, font, scale, color, thickness):
+        """
+        Dibuja un texto copiando su rasterizado ya cacheado. Solo si el
+        texto cabe entero en el frame: recortado por un borde, cv2.putText
+        recorta cada trazo contra el frame y el resultado no coincide con
+        el parche, así que en ese caso se dibuja con cv2.putText
+
+        Args:
+            frame: Frame donde dibujar
+            text: Texto a dibujar
+            org: Esquina inferior izquierda del texto (x, y)
+            font: Fuente de OpenCV
+            scale: Escala de la fuente
+            color: Color BGR
+            thickness: Grosor del trazo
+        """
+        patch, mask, offset_x, offset_y = self._get_text_patch(
+            text, font, scale, color, thickness)
+
+        x0 = org[0] - offset_x
+        y0 = org[1] - offset_y
+        patch_height, patch_width = mask.shape
+        frame_height, frame_width = frame.shape[:2]
+
+        if (x0 < 0 or y0 < 0 or x0 + patch_width > frame_width
+                or y0 + patch_height > frame_height):
+            cv2.putText(frame, text, org, font, scale, color, thickness,
+                        cv2.LINE_8)
+            return
+
+        region = frame[y0:y0 + patch_height, x0:x0 + patch_width]
+        cv2.copyTo(patch, mask, region)
+
     def draw_barcode_info(self, frame, barcode, scale_factor=1.0):
         """
         Dibuja información del código de barras en el frame
@@ -28,46 +187,59 @@ class DisplayManager:
         Returns:
             tuple: (código, tipo_código)
         """
-        # Ajustar coordenadas por el factor de escala
-        (x, y, w, h) = barcode.rect
-        x = int(x / scale_factor)
-        y = int(y / scale_factor)
-        w = int(w / scale_factor)
-        h = int(h / scale_factor)
+        return self.draw_barcodes_batch(frame, [barcode], scale_factor)[0]
 
-        # Dibujar rectángulo alrededor del código
-        cv2.rectangle(
-            frame,
-            (x, y),
-            (x + w, y + h),
-            self.ui_config['rectangle_color'],
-            self.ui_config['rectangle_thickness']
-        )
+    def draw_barcodes_batch(self, frame, barcodes, scale_factor=1.0):
+        """
+        Dibuja la información de todos los códigos de un frame. Las
+        coordenadas de todos los rectángulos se reescalan de una vez
 
-        # Mostrar valor del código
-        barcode_value = barcode.data.decode('utf-8')
-        cv2.putText(
-            frame,
-            barcode_value,
-            (x, y - 10),
-            cv2.FONT_HERSHEY_SIMPLEX,
-            0.5,
-            self.ui_config['rectangle_color'],
-            2
-        )
+        Args:
+            frame: Frame donde dibujar
+            barcodes: Objetos barcode de pyzbar
+            scale_factor: Factor de escala aplicado
 
-        # Mostrar tipo de código
-        cv2.putText(
-            frame,
-            barcode.type,
-            (x, y + h + 20),
-            cv2.FONT_HERSHEY_SIMPLEX,
-            0.4,
-            self.ui_config['type_color'],
-            1
-        )
+        Returns:
+            list: Tuplas (código, tipo_código) en el mismo orden
+        """
+        if not barcodes:
+            return []
+
+        # Ajustar coordenadas por el factor de escala (trunca como int()).
+        # Sin reescalado, caso habitual, se usan tal cual
+        if scale_factor == 1.0:
+            rects = [barcode.rect for barcode in barcodes]
+        else:
+            rects = (np.array([barcode.rect for barcode in barcodes], np.float64)
+                     / scale_factor).astype(np.int32).tolist()
+
+        decode_value = self._decode_value
+        put_text = self._put_text_cached
+        font = self._font
+        rect_color = self._rect_color
+        rect_thick = self._rect_thick
+        label_thick = self._label_thick
+        type_color = self._type_color
 
-        return barcode_value, barcode.type
+        results = []
+        for barcode, (x, y, w, h) in zip(barcodes, rects):
+            barcode_value = decode_value(barcode.data)
+            barcode_type = barcode.type
+
+            # Dibujar rectángulo alrededor del código
+            cv2.rectangle(frame, (x, y), (x + w, y + h), rect_color, rect_thick)
+
+            # Mostrar valor y tipo del código: ambas etiquetas se repiten
+            # mientras el código sigue en cámara, así que salen de la caché.
+            # Si quedan recortadas por un borde (p. ej. el valor de un código
+            # pegado al borde superior) se dibujan con cv2.putText
+            put_text(frame, barcode_value, (x, y - 10), font, 0.5, rect_color,
+                     label_thick)
+            put_text(frame, barcode_type, (x, y + h + 20), font, 0.4, type_color, 1)
+
+            results.append((barcode_value, barcode_type))
+
+        return results
 
     def draw_interface_info(self, frame, detected_count, current_mode, mode_names):
         """
@@ -79,48 +251,66 @@ class DisplayManager:
             current_mode: Modo de procesamiento actual
             mode_names: Lista de nombres de modos
         """
-        # Información principal
-        info_text = f"Codigos detectados: {detected_count} | Modo: {mode_names[current_mode]}"
-        cv2.putText(
+        # Información principal: solo se formatea de nuevo si ha cambiado
+        key = (detected_count, current_mode)
+        if key != self._last_info_key:
+            self._last_info_text = f"Codigos detectados: {detected_count} | Modo: {mode_names[current_mode]}"
+            self._last_info_key = key
+
+        self._put_text_cached(
             frame,
-            info_text,
+            self._last_info_text,
             (10, 30),
-            cv2.FONT_HERSHEY_SIMPLEX,
-            self.ui_config['font_scale'],
-            self.ui_config['font_color'],
-            self.ui_config['font_thickness']
+            self._font,
+            self._font_scale,
+            self._font_color,
+            self._font_thick
         )
 
         # Instrucciones en la parte inferior
         instructions = "q: salir | c: limpiar | s: cambiar modo"
-        cv2.putText(
+        height = frame.shape[0]
+        if height != self._last_h:
+            self._last_h = height
+            self._instr_y = height - 10
+
+        self._put_text_cached(
             frame,
             instructions,
-            (10, frame.shape[0] - 10),
-            cv2.FONT_HERSHEY_SIMPLEX,
+            (10, self._instr_y),
+            self._font,
             0.5,
-            self.ui_config['font_color'],
+            self._font_color,
             1
         )
 
-    def display_frame(self, frame):
+    def display_frame(self, frame) -> bool:
         """
-        Muestra el frame en la ventana
+        Muestra el frame en la ventana, como mucho a display_fps por segundo.
+        Los frames que llegan antes de tiempo no se copian a la ventana
 
         Args:
             frame: Frame a mostrar
+
+        Returns:
+            True si el frame se mostró
         """
-        cv2.imshow(self.ui_config['window_name'], frame)
+        now = time.monotonic()
+        if now - self._last_show < self._show_interval:
+            return False
+
+        cv2.imshow(self._window, frame)
+        self._last_show = now
+        return True
 
     def print_startup_messages(self):
         """
         Muestra mensajes de inicio en consola
         """
         startup = self.messages['startup']
-        print(startup['title'])
-        for instruction in startup['instructions']:
-            print(instruction)
-        print("\n" + startup['separator'])
+        sys.stdout.write(f"{startup['title']}\n"
+                         + "\n".join(startup['instructions'])
+                         + f"\n\n{startup['separator']}\n")
 
     def print_detection_message(self, code_data, code_type, timestamp, is_valid, total_count):
         """
@@ -133,21 +323,16 @@ class DisplayManager:
             is_valid: Si es válido según validación
             total_count: Total de códigos detectados
         """
-        detection = self.messages['detection']
+        templates = self._detection_templates
 
+        # Un único registro multilínea; el formateo ocurre en el hilo de logging
         if is_valid and code_type == 'EAN13':
-            print(f"\n{detection['valid_code']}")
-            print(f"   Código: {code_data}")
-            print(f"   Tipo: {code_type}")
-            print(f"   Hora: {timestamp}")
-            print(f"   Total detectados: {total_count}")
+            self.logger.info(templates['valid'], code_data, code_type,
+                             timestamp, total_count)
+        elif code_type == 'EAN13':
+            self.logger.info(templates['general'], code_data, code_type, timestamp)
         else:
-            print(f"\n{detection['general_code']}")
-            print(f"   Código: {code_data}")
-            print(f"   Tipo: {code_type}")
-            print(f"   Hora: {timestamp}")
-            if code_type != 'EAN13':
-                print(f"   {detection['not_ean13']}")
+            self.logger.info(templates['other'], code_data, code_type, timestamp)
 
     def print_system_message(self, message_type, extra_info=None):
         """
@@ -159,44 +344,81 @@ class DisplayManager:
         """
         system_msg = self.messages['system'].get(message_type, message_type)
 
+        # Por la misma cola que las detecciones para conservar el orden
         if extra_info:
-            print(f"\n{system_msg} {extra_info}")
+            self.logger.info("\n%s %s", system_msg, extra_info)
         else:
-            print(f"\n{system_msg}")
+            self.logger.info("\n%s", system_msg)
 
-    def print_final_summary(self, detected_codes):
+    def print_statistics(self, stats):
+        """
+        Muestra las estadísticas del historial. Va por la cola de logging
+        para no adelantarse a las detecciones pendientes de escribir
+
+        Args:
+            stats: Estadísticas de CodeStorage.get_statistics()
+        """
+        self.logger.info(
+            "\n📊 ESTADÍSTICAS:\n   Total: %s\n   Válidos: %s"
+            "\n   Farmacéuticos: %s\n   Tasa de detección: %.2f%%",
+            stats['total'], stats['valid'], stats['pharmaceutical'],
+            stats['detection_rate'] * 100)
+
+    def print_final_summary(self, detected_codes, valid_codes=None, invalid_codes=None):
         """
         Muestra resumen final de códigos detectados
 
         Args:
             detected_codes: Lista de códigos detectados
+            valid_codes: Códigos válidos ya separados (opcional)
+            invalid_codes: Códigos inválidos ya separados (opcional)
         """
-        print(f"\n📊 RESUMEN FINAL:")
-        print(f"   Total de códigos detectados: {len(detected_codes)}")
+        # Los mensajes aún encolados deben aparecer antes que el resumen
+        self.flush()
+
+        # Se compone el resumen completo y se escribe de una sola vez
+        total = len(detected_codes)
+        lines = [
+            "\n📊 RESUMEN FINAL:",
+            f"   Total de códigos detectados: {total}"
+        ]
 
-        if detected_codes:
-            # Separar códigos válidos e inválidos
-            valid_codes = [
-                code for code in detected_codes if code.get('valido', False)]
-            invalid_codes = [
-                code for code in detected_codes if not code.get('valido', False)]
+        if total:
+            if valid_codes is None or invalid_codes is None:
+                # Separar códigos válidos e inválidos en una sola pasada
+                valid_codes, invalid_codes = [], []
+                add_valid, add_invalid = valid_codes.append, invalid_codes.append
+                for code in detected_codes:
+                    (add_valid if code.get('valido', False) else add_invalid)(code)
 
             if valid_codes:
-                print(f"\n✅ CÓDIGOS EAN-13 VÁLIDOS ({len(valid_codes)}):")
-                for i, code_info in enumerate(valid_codes, 1):
-                    print(
-                        f"   {i}. {code_info['codigo']} - {code_info['timestamp']}")
+                lines.append(f"\n✅ CÓDIGOS EAN-13 VÁLIDOS ({len(valid_codes)}):")
+                lines.extend(
+                    f"   {i}. {code_info['codigo']} - {code_info['timestamp']}"
+                    for i, code_info in enumerate(valid_codes, 1))
 
             if invalid_codes:
-                print(f"\n📦 OTROS CÓDIGOS DETECTADOS ({len(invalid_codes)}):")
-                for i, code_info in enumerate(invalid_codes, 1):
-                    print(
-                        f"   {i}. {code_info['codigo']} ({code_info['tipo']}) - {code_info['timestamp']}")
+                lines.append(f"\n📦 OTROS CÓDIGOS DETECTADOS ({len(invalid_codes)}):")
+                lines.extend(
+                    f"   {i}. {code_info['codigo']} ({code_info['tipo']}) - {code_info['timestamp']}"
+                    for i, code_info in enumerate(invalid_codes, 1))
 
-        print(f"\n{self.messages['system']['goodbye']}")
+        lines.append(f"\n{self.messages['system']['goodbye']}")
+        sys.stdout.write('\n'.join(lines) + '\n')
+
+    def flush(self):
+        """
+        Espera a que el hilo de logging haya escrito todos los mensajes
+        encolados hasta el momento
+        """
+        self._log_listener.queue.join()
 
     def cleanup(self):
         """
         Limpia recursos de visualización
         """
         cv2.destroyAllWindows()
+
+        # Vaciar la cola de mensajes pendientes y detener el hilo de logging
+        self.flush()
+        self._log_listener.stop()
@@ -0,0 +1,64 @@
+# utils/logger.py
+"""
+Logging asíncrono: los mensajes se encolan y un hilo en segundo plano
+se encarga de escribirlos
+"""
+
+import logging
+import logging.handlers
+import queue
+import sys
+from config import LOGGING_CONFIG
+
+LOGGER_NAME = 'barcode_detector'
+
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler que encola el registro sin formatearlo: el mensaje se
+    compone con sus argumentos en el hilo del QueueListener
+    """
+
+    def prepare(self, record):
+        # La cola es local al proceso, no hace falta serializar el registro
+        return record
+
+
+def create_queue_logger(name: str = LOGGER_NAME):
+    """
+    Crea un logger cuyo único handler encola los registros. Un QueueListener
+    los formatea y escribe desde su propio hilo en consola y/o archivo según
+    LOGGING_CONFIG, de modo que quien registra nunca espera por la E/S.
+    Los argumentos del mensaje se interpolan también en ese hilo
+
+    Args:
+        name: Nombre del logger
+
+    Returns:
+        tuple: (logger, listener) - el listener debe detenerse al terminar
+    """
+    handlers = []
+
+    if LOGGING_CONFIG['enable_console_output']:
+        console_handler = logging.StreamHandler(sys.stdout)
+        console_handler.setFormatter(logging.Formatter('%(message)s'))
+        handlers.append(console_handler)
+
+    if LOGGING_CONFIG['enable_file_output']:
+        file_handler = logging.FileHandler(
+            LOGGING_CONFIG['log_file'], encoding='utf-8')
+        file_handler.setFormatter(logging.Formatter(
+            '%(asctime)s %(message)s', LOGGING_CONFIG['date_format']))
+        handlers.append(file_handler)
+
+    log_queue = queue.Queue(-1)
+
+    logger = logging.getLogger(name)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    logger.handlers = [_DeferredQueueHandler(log_queue)]
+
+    listener = logging.handlers.QueueListener(log_queue, *handlers)
+    listener.start()
+
+    return logger, listener